@@ -7,6 +7,7 @@ from app.routes.tracker.recurring import recurring
 import datetime
 from flask import jsonify
 from flask_migrate import Migrate
+from jinja2 import FileSystemBytecodeCache
 
 def create_app():
     app = Flask(__name__, static_folder='../static', static_url_path='/static')
@@ -23,6 +24,13 @@ def create_app():
     app.config['LEGACY_AUTH_ENABLED'] = True  # Enable during migration period
     app.config['ADMIN_ACCESS_ENABLED'] = True  # For admin endpoints
 
+    # Drop the indentation and newlines around {% %} tags from rendered pages
+    app.jinja_env.trim_blocks = True
+    app.jinja_env.lstrip_blocks = True
+    
+    # Keep compiled templates on disk so new workers skip parsing them again
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_BYTECODE_CACHE_DIR'])
+
     # Initialize extensions
     db.init_app(app)
 
@@ -9,6 +9,25 @@ from flask import current_app
 
 groups_bp = Blueprint('groups', __name__, url_prefix='/groups')
 
+# Links used by the group pages, built once per script root instead of on every render
+_page_urls = {}
+
+@groups_bp.context_processor
+def inject_page_urls():
+    """Expose the group pages' fixed links to their templates as page_urls"""
+    urls = _page_urls.get(request.script_root)
+    if urls is None:
+        urls = _page_urls[request.script_root] = {
+            'dashboard_home': url_for('dashboard.home'),
+            'profile': url_for('auth.profile'),
+            'logout': url_for('auth.logout'),
+            'create_group': url_for('groups.create'),
+            'join_group': url_for('groups.join'),
+            'groups_css': url_for('static', filename='css/groups/groups.css'),
+            'group_forms_css': url_for('static', filename='css/groups/group-forms.css')
+        }
+    return {'page_urls': urls}
+
 def check_user_financial_involvement(user_id, group_id):
     """
     Check if user has any financial involvement that prevents leaving the group
@@ -37,14 +56,33 @@ def check_user_financial_involvement(user_id, group_id):
             details.append(f"You owe ${abs(user_balance.amount):.2f}")
     
     # Still collect historical data for display purposes, but don't use it to prevent leaving
-    expenses_paid = Expense.query.filter_by(user_id=user_id, group_id=group_id).count()
-    expenses_participated = db.session.query(ExpenseParticipant).join(Expense).filter(
+    # All four counts come back from one SELECT of scalar subqueries
+    expenses_paid_count = db.session.query(func.count(Expense.id)).filter(
+        Expense.user_id == user_id,
+        Expense.group_id == group_id
+    ).scalar_subquery()
+    expenses_participated_count = db.session.query(func.count(ExpenseParticipant.id)).join(
+        Expense, ExpenseParticipant.expense_id == Expense.id
+    ).filter(
         ExpenseParticipant.user_id == user_id,
         Expense.group_id == group_id,
         ExpenseParticipant.user_id != Expense.user_id
-    ).count()
-    settlements_made = Settlement.query.filter_by(payer_id=user_id, group_id=group_id).count()
-    settlements_received = Settlement.query.filter_by(receiver_id=user_id, group_id=group_id).count()
+    ).scalar_subquery()
+    settlements_made_count = db.session.query(func.count(Settlement.id)).filter(
+        Settlement.payer_id == user_id,
+        Settlement.group_id == group_id
+    ).scalar_subquery()
+    settlements_received_count = db.session.query(func.count(Settlement.id)).filter(
+        Settlement.receiver_id == user_id,
+        Settlement.group_id == group_id
+    ).scalar_subquery()
+    
+    expenses_paid, expenses_participated, settlements_made, settlements_received = db.session.query(
+        expenses_paid_count,
+        expenses_participated_count,
+        settlements_made_count,
+        settlements_received_count
+    ).one()
     
     involvement['expenses_paid'] = expenses_paid
     involvement['expenses_participated'] = expenses_participated
@@ -65,8 +103,23 @@ def check_user_financial_involvement(user_id, group_id):
 @login_required
 def index():
     """Groups management page"""
-    user_groups = current_user.groups
-    return render_template('dashboard/groups.html', user_groups=user_groups)
+    # Load the user's groups with their member counts in one query instead of
+    # loading every group's members while the page renders
+    member_count = db.session.query(func.count(user_groups.c.user_id)).filter(
+        user_groups.c.group_id == Group.id
+    ).correlate(Group).scalar_subquery()
+    rows = db.session.query(Group, member_count).join(
+        user_groups, user_groups.c.group_id == Group.id
+    ).filter(user_groups.c.user_id == current_user.id).all()
+    
+    user_id = current_user.id
+    groups = []
+    for group, count in rows:
+        group.is_admin = group.creator_id == user_id
+        group.member_count = count
+        group.created_at_display = group.created_at.strftime('%b %d, %Y') if group.created_at else ''
+        groups.append(group)
+    return render_template('dashboard/groups.html', user_groups=groups)
 
 @groups_bp.route('/create', methods=['GET', 'POST'])
 @login_required
@@ -3,7 +3,6 @@
 from flask import Blueprint, request, jsonify
 from models import ExpenseParticipant, db, RecurringPayment, User, Category, Group, Expense, user_groups
 from app.services.tracker.recurring_service import RecurringPaymentService
-from app.services.tracker.balance_service import BalanceService
 from datetime import datetime, date
 from flask_login import current_user
 import logging
@@ -161,14 +160,6 @@ def create_recurring_payment_api(group_id):
         
         logger.info(f"[CREATE] Created recurring payment with ID: {recurring_payment.id}")
         
-        # FIXED: Force balance recalculation to ensure expenses appear in tables
-        try:
-            logger.info(f"[CREATE] Forcing balance recalculation for group {group_id}")
-            BalanceService.recalculate_all_balances()
-            logger.info(f"[CREATE] Balance recalculation completed for group {group_id}")
-        except Exception as e:
-            logger.warning(f"[CREATE] Balance calculation warning: {e}")
-        
         return jsonify({
             'success': True,
             'message': 'Recurring payment created successfully',
@@ -357,19 +348,9 @@ def process_recurring_payment_api(group_id, payment_id):
                 'message': 'This recurring payment has already been processed for today'
             }), 400
         
-        # Create the expense directly (this now includes balance updates)
+        # Create the expense directly (this commits and updates the group's balances)
         expense = RecurringPaymentService._create_expense_from_recurring_manual(recurring_payment, expense_date)
         
-        # Commit the transaction
-        db.session.commit()
-        
-        # FIXED: Ensure balance calculation happens after manual processing
-        try:
-            logger.info(f"[MANUAL] Updating balances for group {group_id} after manual processing")
-            BalanceService.recalculate_all_balances()
-        except Exception as e:
-            logger.warning(f"[MANUAL] Balance calculation warning: {e}")
-        
         logger.info(f"Successfully created expense {expense.id} from recurring payment {payment_id}")
         
         return jsonify({
@@ -406,15 +387,6 @@ def process_group_due_payments(group_id):
         
         logger.info(f"[GROUP_PROCESS] Created {len(created_expenses)} expenses for group {group_id}")
         
-        # FIXED: Force balance recalculation to ensure table updates
-        if created_expenses:
-            try:
-                logger.info(f"[GROUP_PROCESS] Forcing balance recalculation for group {group_id}")
-                BalanceService.recalculate_all_balances()
-                logger.info(f"[GROUP_PROCESS] Balance recalculation completed")
-            except Exception as e:
-                logger.warning(f"[GROUP_PROCESS] Balance calculation warning: {e}")
-        
         return jsonify({
             'success': True,
             'message': f'Processed {len(created_expenses)} due recurring payments for group',
@@ -42,7 +42,9 @@ class AccountDeletionService:
                 personal_groups.append({
                     'id': group.id,
                     'name': group.name,
-                    'expense_count': len(group.expenses)
+                    'expense_count': db.session.query(func.count(Expense.id)).filter(
+                        Expense.group_id == group.id
+                    ).scalar()
                 })
             else:
                 # Shared group - user will be replaced with placeholder
@@ -50,7 +52,10 @@ class AccountDeletionService:
                     'id': group.id,
                     'name': group.name,
                     'member_count': member_count,
-                    'expense_count': len([e for e in group.expenses if e.user_id == user.id]),
+                    'expense_count': db.session.query(func.count(Expense.id)).filter(
+                        Expense.group_id == group.id,
+                        Expense.user_id == user.id
+                    ).scalar(),
                     'balance': user.get_group_balance(group.id)
                 })
                 
@@ -1,10 +1,13 @@
 # balance_service.py - UPDATED to be group-aware
 
-from models import db, User, Expense, ExpenseParticipant, Balance, Settlement, Group
+from models import db, User, Expense, ExpenseParticipant, Balance, Settlement, Group, user_groups
 from datetime import datetime
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import func
+from sqlalchemy import DateTime, bindparam, func, insert, literal, select, union_all, update
 import threading
+import logging
+
+logger = logging.getLogger(__name__)
 
 class BalanceService:
     # Thread lock to prevent concurrent balance recalculations
@@ -14,7 +17,7 @@ class BalanceService:
     def create_expense_with_participants(amount, payer_id, participant_ids, category_id, 
                                        category_description=None, date=None, split_type='equal', group_id=None):
         """
-        Create a new expense and recalculate balances
+        Create a new expense and apply it to the stored balances
         UPDATED: Now group-aware
         """
         try:
@@ -25,18 +28,20 @@ class BalanceService:
             if amount <= 0:
                 raise ValueError("Amount must be positive")
             
-            # Create expense
-            expense = Expense(
-                amount=amount,
-                user_id=payer_id,
-                category_id=category_id,
-                category_description=category_description,
-                date=date or datetime.now().date(),
-                split_type=split_type,
-                group_id=group_id  # Add group context
-            )
-            db.session.add(expense)
-            db.session.flush()  # Get the expense ID
+            # Create expense, getting the row (and its ID) back from the INSERT
+            # itself via RETURNING rather than a separate flush
+            expense = db.session.scalars(
+                insert(Expense).returning(Expense),
+                [{
+                    'amount': amount,
+                    'user_id': payer_id,
+                    'category_id': category_id,
+                    'category_description': category_description,
+                    'date': date or datetime.now().date(),
+                    'split_type': split_type,
+                    'group_id': group_id  # Add group context
+                }]
+            ).one()
             
             # Calculate individual shares
             if split_type == 'equal':
@@ -46,47 +51,82 @@ class BalanceService:
                 # For custom splits, you'd pass in participant_amounts directly
                 raise NotImplementedError("Custom splits not implemented yet")
             
-            # Create participant records
+            # Create participant records with one multi-row INSERT
+            db.session.execute(insert(ExpenseParticipant), [
+                {
+                    'expense_id': expense.id,
+                    'user_id': participant_id,
+                    'amount_owed': participant_amounts[participant_id],
+                    'group_id': group_id  # Add group context
+                }
+                for participant_id in participant_ids
+            ])
+            
+            # Apply this expense's effect to the stored balances in the same
+            # transaction: the payer is credited the full amount and each
+            # participant is debited their share
+            deltas = {payer_id: amount}
             for participant_id in participant_ids:
-                participant = ExpenseParticipant(
-                    expense_id=expense.id,
-                    user_id=participant_id,
-                    amount_owed=participant_amounts[participant_id],
-                    group_id=group_id  # Add group context
-                )
-                db.session.add(participant)
+                deltas[participant_id] = deltas.get(participant_id, 0) - participant_amounts[participant_id]
             
-            db.session.commit()
+            BalanceService._apply_balance_deltas(deltas, group_id)
             
-            # Recalculate balances for the affected group or all balances
-            if group_id:
-                # Use the new group-specific recalculation from ExpenseService
-                from app.services.tracker.expense_service import ExpenseService
-                ExpenseService._recalculate_group_balances(group_id)
-            else:
-                # Legacy: recalculate all balances
-                BalanceService.recalculate_all_balances()
+            db.session.commit()
             
             return expense
             
-        except Exception as e:
+        except Exception:
             db.session.rollback()
-            print(f"Error creating expense: {e}")
+            logger.exception("Error creating expense")
             return None
     
     @staticmethod
     def _update_user_balance(user_id, amount, group_id=None):
         """Update a single user's balance (group-aware)"""
+        BalanceService._apply_balance_deltas({user_id: amount}, group_id)
+    
+    @staticmethod
+    def _apply_balance_deltas(deltas, group_id=None):
+        """
+        Add amounts to several users' balances in one group (group-aware)
+        
+        Balance has no unique (user_id, group_id) constraint to upsert against, so the
+        existing records are looked up once, all of them are updated with a single
+        executemany by primary key, and the missing ones are created with one INSERT
+        
+        Args:
+            deltas: user_id -> amount to add
+        """
+        now = datetime.utcnow()
+        
+        # First record per user, so a stray duplicate row isn't credited twice
+        balance_ids = dict(
+            db.session.query(Balance.user_id, func.min(Balance.id)).filter(
+                Balance.group_id.is_(None) if group_id is None else Balance.group_id == group_id,
+                Balance.user_id.in_(deltas)
+            ).group_by(Balance.user_id)
+        )
         
-        # Get or create balance record for this user and group
-        balance = Balance.query.filter_by(user_id=user_id, group_id=group_id).first()
-        if not balance:
-            balance = Balance(user_id=user_id, group_id=group_id, amount=0.0)
-            db.session.add(balance)
+        # Add to the existing balances in the database without loading them first
+        if balance_ids:
+            balance_table = Balance.__table__
+            db.session.execute(
+                update(balance_table)
+                .where(balance_table.c.id == bindparam('balance_id'))
+                .values(amount=balance_table.c.amount + bindparam('delta'), last_updated=now),
+                [
+                    {'balance_id': balance_id, 'delta': deltas[user_id]}
+                    for user_id, balance_id in balance_ids.items()
+                ]
+            )
         
-        # Update balance
-        balance.amount += amount
-        balance.last_updated = datetime.utcnow()
+        # No balance record for these users in this group yet - create them
+        missing_user_ids = [user_id for user_id in deltas if user_id not in balance_ids]
+        if missing_user_ids:
+            db.session.execute(insert(Balance), [
+                {'user_id': user_id, 'group_id': group_id, 'amount': deltas[user_id], 'last_updated': now}
+                for user_id in missing_user_ids
+            ])
     
     @staticmethod
     def get_all_balances(group_id=None):
@@ -96,7 +136,7 @@ class BalanceService:
         """
         query = db.session.query(
             User.id,
-            User.name,
+            BalanceService._user_name_column(),
             Balance.amount,
             Balance.last_updated
         ).outerjoin(Balance, User.id == Balance.user_id)
@@ -124,94 +164,156 @@ class BalanceService:
         
         return result
     
+    @staticmethod
+    def _get_balance_tuples(group_id=None):
+        """
+        (user_name, amount) for every balance that isn't settled, largest amount first
+        Same scope as get_all_balances, without building its per-user dicts
+        """
+        query = db.session.query(
+            BalanceService._user_name_column(),
+            Balance.amount
+        ).join(Balance, User.id == Balance.user_id).filter(func.abs(Balance.amount) > 0.01)
+        
+        if group_id:
+            query = query.filter(
+                Balance.group_id == group_id,
+                User.id.in_(
+                    db.session.query(user_groups.c.user_id).filter(user_groups.c.group_id == group_id)
+                )
+            )
+        
+        return query.order_by(Balance.amount.desc()).all()
+    
+    @staticmethod
+    def _user_name_column():
+        """SQL equivalent of the User.name property"""
+        return func.coalesce(User.display_name, User.full_name)
+    
     @staticmethod
     def get_settlement_suggestions(group_id=None):
         """
         Calculate optimal settlements - can be filtered by group
         UPDATED: Group-aware
         """
-        balances = BalanceService.get_all_balances(group_id)
-        
-        # Separate creditors (positive balance) and debtors (negative balance)
-        creditors = [(b['user_name'], b['balance']) for b in balances if b['balance'] > 0.01]
-        debtors = [(b['user_name'], abs(b['balance'])) for b in balances if b['balance'] < -0.01]
-        
-        # Sort by amount (largest first)
-        creditors.sort(key=lambda x: x[1], reverse=True)
-        debtors.sort(key=lambda x: x[1], reverse=True)
+        # Separate creditors (positive balance) and debtors (negative balance),
+        # both largest first, straight from the (user_name, amount) rows.
+        # Amounts are matched in whole cents so leftovers are exactly zero
+        balances = BalanceService._get_balance_tuples(group_id)
+        creditors = [(name, round(amount * 100)) for name, amount in balances if amount > 0]
+        debtors = [(name, round(-amount * 100)) for name, amount in reversed(balances) if amount < 0]
         
         settlements = []
+        if not creditors or not debtors:
+            return settlements
+        
+        # Walk both lists with one index each, keeping what is left of the
+        # current creditor and debtor in locals instead of rewriting the lists
         i, j = 0, 0
+        creditor_name, credit_amount = creditors[0]
+        debtor_name, debt_amount = debtors[0]
         
-        while i < len(creditors) and j < len(debtors):
-            creditor_name, credit_amount = creditors[i]
-            debtor_name, debt_amount = debtors[j]
-            
+        while True:
             # Settle the smaller amount
             settlement_amount = min(credit_amount, debt_amount)
             
             settlements.append({
                 'from': debtor_name,
                 'to': creditor_name,
-                'amount': round(settlement_amount, 2)
+                'amount': settlement_amount / 100
             })
             
             # Update amounts
-            creditors[i] = (creditor_name, credit_amount - settlement_amount)
-            debtors[j] = (debtor_name, debt_amount - settlement_amount)
+            credit_amount -= settlement_amount
+            debt_amount -= settlement_amount
             
             # Move to next if fully settled
-            if creditors[i][1] < 0.01:
+            if not credit_amount:
                 i += 1
-            if debtors[j][1] < 0.01:
+                if i == len(creditors):
+                    break
+                creditor_name, credit_amount = creditors[i]
+            if not debt_amount:
                 j += 1
+                if j == len(debtors):
+                    break
+                debtor_name, debt_amount = debtors[j]
         
         return settlements
     
     @staticmethod
-    def recalculate_all_balances():
+    def recalculate_all_balances(group_ids=None):
         """
-        LEGACY METHOD: Recalculate all balances from scratch (no group filtering)
+        LEGACY METHOD: Recalculate all balances from scratch
         This is kept for backward compatibility
+        
+        Args:
+            group_ids: If provided, only balances for these groups are rebuilt
         """
         with BalanceService._lock:
             try:
                 # Use a database transaction to ensure consistency
                 with db.session.begin():
-                    # Delete all existing balances
-                    db.session.query(Balance).delete()
-                    db.session.flush()
-
-                    # Process all expenses
-                    expenses = db.session.query(Expense).all()
+                    balance_query = db.session.query(Balance)
                     
-                    for expense in expenses:
-                        participants = expense.participants
-                        if not participants:
-                            continue
-                        
-                        # Credit the payer with the full amount they paid
-                        BalanceService._update_user_balance(expense.user_id, expense.amount, expense.group_id)
-                        
-                        # Debit each participant their share
-                        for participant in participants:
-                            BalanceService._update_user_balance(participant.user_id, -participant.amount_owed, expense.group_id)
-                            
-                    # Process all settlements
-                    settlements = db.session.query(Settlement).all()
+                    # Signed sums per (user_id, group_id), computed by the database
+                    # Payers are credited only for expenses that have participants
+                    has_participants = select(ExpenseParticipant.id).where(
+                        ExpenseParticipant.expense_id == Expense.id
+                    ).exists()
+                    credits = select(
+                        Expense.user_id.label('user_id'),
+                        Expense.group_id.label('group_id'),
+                        func.sum(Expense.amount).label('amount')
+                    ).where(has_participants).group_by(Expense.user_id, Expense.group_id)
+                    # Each participant is debited under the group of the expense they share
+                    debits = select(
+                        ExpenseParticipant.user_id, Expense.group_id, -func.sum(ExpenseParticipant.amount_owed)
+                    ).join_from(
+                        ExpenseParticipant, Expense, ExpenseParticipant.expense_id == Expense.id
+                    ).group_by(ExpenseParticipant.user_id, Expense.group_id)
+                    # When someone pays someone else:
+                    # - Payer's balance increases (owes less)
+                    # - Receiver's balance decreases (owed less)
+                    paid = select(
+                        Settlement.payer_id, Settlement.group_id, func.sum(Settlement.amount)
+                    ).group_by(Settlement.payer_id, Settlement.group_id)
+                    received = select(
+                        Settlement.receiver_id, Settlement.group_id, -func.sum(Settlement.amount)
+                    ).group_by(Settlement.receiver_id, Settlement.group_id)
+                    
+                    if group_ids is not None:
+                        group_ids = list(group_ids)
+                        balance_query = balance_query.filter(Balance.group_id.in_(group_ids))
+                        credits = credits.where(Expense.group_id.in_(group_ids))
+                        debits = debits.where(Expense.group_id.in_(group_ids))
+                        paid = paid.where(Settlement.group_id.in_(group_ids))
+                        received = received.where(Settlement.group_id.in_(group_ids))
                     
-                    for settlement in settlements:
-                        # When someone pays someone else:
-                        # - Payer's balance increases (owes less)
-                        # - Receiver's balance decreases (owed less)
-                        BalanceService._update_user_balance(settlement.payer_id, settlement.amount, settlement.group_id)
-                        BalanceService._update_user_balance(settlement.receiver_id, -settlement.amount, settlement.group_id)
+                    # Delete existing balances in scope
+                    balance_query.delete(synchronize_session=False)
+                    db.session.flush()
+
+                    # Net the four sums per (user_id, group_id) and write every balance
+                    # in scope back with a single INSERT ... SELECT
+                    totals = union_all(credits, debits, paid, received).subquery()
+                    db.session.execute(
+                        insert(Balance).from_select(
+                            ['user_id', 'group_id', 'amount', 'last_updated'],
+                            select(
+                                totals.c.user_id,
+                                totals.c.group_id,
+                                func.sum(totals.c.amount),
+                                literal(datetime.utcnow(), DateTime)
+                            ).group_by(totals.c.user_id, totals.c.group_id)
+                        )
+                    )
                         
                 # Transaction automatically commits here if no exceptions
                 return True
 
-            except Exception as e:
-                print(f"[ERROR] Error recalculating balances: {e}")
+            except Exception:
+                logger.exception("Error recalculating balances")
                 # Transaction automatically rolls back on exception
                 return False
     
@@ -244,18 +346,19 @@ class BalanceService:
             balances = BalanceService.get_all_balances()
             
             # Get total expenses per user
+            user_name = BalanceService._user_name_column()
             expense_totals = db.session.query(
-                User.name,
+                user_name,
                 func.sum(Expense.amount).label('total_paid')
             ).join(Expense, User.id == Expense.user_id)\
-             .group_by(User.id, User.name).all()
+             .group_by(User.id, User.display_name, User.full_name).all()
             
             # Get total owed per user (from expense participants)
             owed_totals = db.session.query(
-                User.name,
+                user_name,
                 func.sum(ExpenseParticipant.amount_owed).label('total_owed')
             ).join(ExpenseParticipant, User.id == ExpenseParticipant.user_id)\
-             .group_by(User.id, User.name).all()
+             .group_by(User.id, User.display_name, User.full_name).all()
             
             # Get settlements
             settlement_data = db.session.query(Settlement).all()
@@ -1,35 +1,58 @@
 """
 Service for handling recurring payment logic - FIXED with balance updates and proper group filtering
 """
+from collections import defaultdict
 from datetime import datetime, date, timedelta
 from app.services.tracker.expense_service import ExpenseService
-from models import db, RecurringPayment, Expense, ExpenseParticipant, User, Category
+from models import db, RecurringPayment, Expense, ExpenseParticipant, User, Category, Group
 from app.services.tracker.balance_service import BalanceService
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy import inspect
+from sqlalchemy.orm import selectinload
 import json
 import logging
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Max rows per executemany when bulk-inserting expense participants
+PARTICIPANT_INSERT_CHUNK_SIZE = 1000
+
+# Columns of the unique expense index that recurring expense inserts use as their ON CONFLICT target
+RECURRING_EXPENSE_KEY = ['recurring_payment_id', 'date', 'group_id']
+
 class RecurringPaymentService:
+    # Databases known to have the unique recurring expense index
+    _databases_with_recurring_expense_index = set()
     
     @staticmethod
-    def process_group_due_payments(group_id, check_date=None):
+    def process_group_due_payments(group_id, check_date=None, defer_balance_update=False, group=None,
+                                   due_payments=None, defer_commit=False):
         """
         Process due recurring payments for a specific group
         FIXED: Now properly updates balances and settlements after creating expenses
+        
+        When defer_balance_update is True the caller is responsible for
+        recalculating balances (used to batch recalculation across groups),
+        and when defer_commit is True for committing - committing here would
+        expire the payments the caller loaded for its other groups.
+        Callers that already loaded the Group can pass it as group, and
+        callers that already fetched this group's due payments can pass them
+        as due_payments to skip the query.
         """
         if check_date is None:
             check_date = datetime.now().date()
+        # One timestamp for every payment touched in this batch
+        batch_now = datetime.utcnow()
         
         logger.info(f"🔄 PROCESSING: Checking for due/overdue recurring payments for group {group_id} up to {check_date}...")
         
         # Get all active recurring payments for this group that are due or overdue
-        due_payments = RecurringPayment.query.filter(
-            RecurringPayment.group_id == group_id,
-            RecurringPayment.is_active == True,
-            RecurringPayment.next_due_date <= check_date
-        ).all()
+        if due_payments is None:
+            due_payments = RecurringPaymentService._due_payments_query(check_date).filter(
+                RecurringPayment.group_id == group_id
+            ).all()
         
         if not due_payments:
             logger.info(f"✅ PROCESSING: No due or overdue recurring payments found for group {group_id}")
@@ -37,72 +60,86 @@ class RecurringPaymentService:
         
         logger.info(f"📋 PROCESSING: Found {len(due_payments)} payments to check for group {group_id}:")
         
-        created_expenses = []
-        processed_count = 0
-        skipped_count = 0
+        # Members were eager-loaded above, so this resolves from the identity map
+        if group is None:
+            group = db.session.get(Group, group_id)
+        group_member_ids = frozenset(member.id for member in group.members) if group else frozenset()
+        
+        pending_expense_rows = []
+        splits_by_payment = {}
+        due_dates_by_payment = {}
+        # Payments whose expenses couldn't be built keep their next_due_date for a retry
+        failed_payment_ids = set()
         
         for recurring_payment in due_payments:
-            days_diff = (check_date - recurring_payment.next_due_date).days
-            status = "due today" if days_diff == 0 else f"overdue by {days_diff} days"
+            if logger.isEnabledFor(logging.INFO):
+                days_diff = (check_date - recurring_payment.next_due_date).days
+                status = "due today" if days_diff == 0 else f"overdue by {days_diff} days"
+                logger.info("   🔍 Checking: %s - $%s (%s)",
+                            recurring_payment.category_obj.name, recurring_payment.amount, status)
             
-            logger.info(f"   🔍 Checking: {recurring_payment.category_obj.name} - ${recurring_payment.amount} ({status})")
+            # Process ALL missed dates from next_due_date up through check_date,
+            # never going past the payment's end_date
+            window_end = check_date
+            if recurring_payment.end_date and recurring_payment.end_date < window_end:
+                window_end = recurring_payment.end_date
+            due_dates = recurring_payment.generate_due_dates(recurring_payment.next_due_date, window_end)
+            if not due_dates:
+                continue
+            due_dates_by_payment[recurring_payment.id] = due_dates
             
-            # Process ALL missed dates from next_due_date up through check_date
-            current_due_date = recurring_payment.next_due_date
-            payment_expenses = []
+            # Queue an expense per date; dates that already have one are skipped by the insert below
+            try:
+                splits_by_payment[recurring_payment.id] = RecurringPaymentService._resolve_participants(
+                    recurring_payment, group_member_ids
+                )
+                for current_due_date in due_dates:
+                    logger.debug("      ✨ Creating expense for %s...", current_due_date)
+                    pending_expense_rows.append(
+                        RecurringPaymentService._build_expense_row(recurring_payment, current_due_date)
+                    )
+            except Exception as e:
+                failed_payment_ids.add(recurring_payment.id)
+                logger.error("      ❌ Error creating expenses for payment %s, leaving it due: %s", recurring_payment.id, e)
+        
+        # Insert every queued expense in one statement, then their participants
+        created_expenses = []
+        if pending_expense_rows:
+            created_expenses = RecurringPaymentService._insert_expense_rows(pending_expense_rows)
             
-            # Process expenses while respecting end_date
-            while current_due_date <= check_date:
-                # Check if current_due_date is beyond end_date BEFORE processing
-                if recurring_payment.end_date and current_due_date > recurring_payment.end_date:
-                    logger.info(f"      🔚 Current due date {current_due_date} is beyond end date {recurring_payment.end_date}, stopping processing")
-                    break
-                
-                # Check if expense already exists for this date
-                existing_expense = Expense.query.filter(
-                    Expense.recurring_payment_id == recurring_payment.id,
-                    Expense.date == current_due_date,
-                    Expense.group_id == group_id  # Check group_id too
-                ).first()
-                
-                if existing_expense:
-                    logger.info(f"      ⏭️  Skipped: Expense #{existing_expense.id} already exists for {current_due_date}")
-                    skipped_count += 1
-                else:
-                    # Create expense for this date
-                    logger.info(f"      ✨ Creating expense for {current_due_date}...")
-                    
-                    try:
-                        expense = RecurringPaymentService._create_expense_for_date(
-                            recurring_payment, 
-                            current_due_date
-                        )
-                        
-                        payment_expenses.append(expense)
-                        created_expenses.append(expense)
-                        
-                        logger.info(f"      ✅ Created expense #{expense.id} for ${expense.amount}")
-                        processed_count += 1
-                        
-                    except Exception as e:
-                        logger.error(f"      ❌ Error creating expense for {current_due_date}: {e}")
-                        continue
-                
-                # Calculate next occurrence
-                old_due_date = current_due_date
-                current_due_date = recurring_payment.calculate_next_due_date(old_due_date)
-                
-                # Safety check to prevent infinite loops
-                if current_due_date <= old_due_date:
-                    logger.error(f"      ⚠️  Date calculation error: {old_due_date} -> {current_due_date}")
-                    break
+            participant_rows = []
+            for expense in created_expenses:
+                valid_participants, amount_per_person = splits_by_payment[expense.recurring_payment_id]
+                participant_rows.extend(
+                    {'expense_id': expense.id, 'user_id': user_id, 'amount_owed': amount_per_person}
+                    for user_id in valid_participants
+                )
+            RecurringPaymentService._insert_participant_rows(participant_rows)
+            
+            if logger.isEnabledFor(logging.DEBUG):
+                for expense in created_expenses:
+                    logger.debug("      ✅ Created expense #%s for $%s on %s", expense.id, expense.amount, expense.date)
+        
+        processed_count = len(created_expenses)
+        skipped_count = len(pending_expense_rows) - processed_count
+        
+        last_created_dates = {}
+        for expense in created_expenses:
+            last_created_dates[expense.recurring_payment_id] = expense.date
+        
+        for recurring_payment in due_payments:
+            if recurring_payment.id in failed_payment_ids:
+                # Don't move past dates that are still owed
+                continue
+            last_created_date = last_created_dates.get(recurring_payment.id)
             
             # After processing, check if payment should be deactivated
-            if payment_expenses:  # If we processed any expenses
-                last_processed_date = payment_expenses[-1].date
-                next_would_be_due = recurring_payment.calculate_next_due_date(last_processed_date)
+            due_dates = due_dates_by_payment.get(recurring_payment.id)
+            if due_dates:
+                # Every date in the window now has an expense, created here or already existing
+                next_would_be_due = recurring_payment.calculate_next_due_date(due_dates[-1])
             else:
-                # No expenses processed, use current next_due_date to calculate next
+                # No dates in the window (already past end_date), step from the current next_due_date
                 next_would_be_due = recurring_payment.calculate_next_due_date(recurring_payment.next_due_date)
             
             # Check if the next due date would be beyond the end date
@@ -111,28 +148,29 @@ class RecurringPaymentService:
                 sentinel_date = datetime(9999, 1, 1)
                 recurring_payment.is_active = False
                 recurring_payment.next_due_date = sentinel_date
-                recurring_payment.last_updated = datetime.utcnow()
-                logger.info(f"      🔚 Next due date {next_would_be_due} would be beyond end date {recurring_payment.end_date}")
-                logger.info(f"      🔚 Set payment as inactive with sentinel date: {sentinel_date}")
+                recurring_payment.last_updated = batch_now
+                logger.info("      🔚 Next due date %s would be beyond end date %s", next_would_be_due, recurring_payment.end_date)
+                logger.info("      🔚 Set payment as inactive with sentinel date: %s", sentinel_date)
             else:
                 # Update the recurring payment's next_due_date to the next future date
                 old_next_due = recurring_payment.next_due_date
                 recurring_payment.next_due_date = next_would_be_due
-                recurring_payment.last_updated = datetime.utcnow()
+                recurring_payment.last_updated = batch_now
                 
-                if payment_expenses:
-                    logger.info(f"      📅 Updated next due date: {old_next_due} → {recurring_payment.next_due_date}")
+                if last_created_date:
+                    logger.info("      📅 Updated next due date: %s → %s", old_next_due, recurring_payment.next_due_date)
         
         # Commit all changes BEFORE updating balances
         if processed_count > 0 or skipped_count > 0:
-            db.session.commit()
+            if not defer_commit:
+                db.session.commit()
             logger.info(f"✅ PROCESSING: Processed {processed_count} payments for group {group_id}, skipped {skipped_count} (already existed)")
             
             # FIXED: Update balances and settlements for the group after creating expenses
-            if created_expenses:
+            if created_expenses and not defer_balance_update:
                 try:
                     logger.info(f"💰 BALANCES: Updating balances for group {group_id} after creating {len(created_expenses)} expenses")
-                    BalanceService.recalculate_all_balances()
+                    BalanceService.recalculate_all_balances(group_ids=[group_id])
                     logger.info(f"✅ BALANCES: Successfully updated balances for group {group_id}")
                 except Exception as e:
                     logger.error(f"❌ BALANCES: Error updating balances for group {group_id}: {e}")
@@ -144,9 +182,96 @@ class RecurringPaymentService:
         return created_expenses
     
     @staticmethod
-    def _create_expense_for_date(recurring_payment, expense_date):
+    def _due_payments_query(check_date):
         """
-        Create an expense record from a recurring payment for a specific date
+        Query for active recurring payments due on or before check_date
+        Eager-loads category and group members so processing doesn't lazy-load per payment
+        """
+        return RecurringPayment.query.options(
+            selectinload(RecurringPayment.category_obj),
+            selectinload(RecurringPayment.group).selectinload(Group.members)
+        ).filter(
+            RecurringPayment.is_active == True,
+            RecurringPayment.next_due_date <= check_date
+        )
+    
+    @staticmethod
+    def _insert_expense_rows(expense_rows):
+        """
+        Bulk-insert recurring expense rows, skipping any (recurring_payment_id, date, group_id)
+        that already has an expense via ON CONFLICT DO NOTHING (or a lookup of the existing
+        rows on databases without it)
+        
+        Returns:
+            list: the Expense objects that were actually inserted, in input order
+        """
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'postgresql' and RecurringPaymentService._has_recurring_expense_index():
+            stmt = postgresql_insert(Expense)
+        elif dialect == 'sqlite' and RecurringPaymentService._has_recurring_expense_index():
+            stmt = sqlite_insert(Expense)
+        else:
+            # No ON CONFLICT support, or no unique index for it to target yet - look up
+            # the dates that already have an expense and add only the rest
+            existing_keys = set(db.session.query(
+                Expense.recurring_payment_id, Expense.date, Expense.group_id
+            ).filter(
+                Expense.recurring_payment_id.in_({row['recurring_payment_id'] for row in expense_rows})
+            ))
+            created_expenses = [
+                Expense(**row) for row in expense_rows
+                if (row['recurring_payment_id'], row['date'], row['group_id']) not in existing_keys
+            ]
+            db.session.add_all(created_expenses)
+            db.session.flush()
+            return created_expenses
+        
+        stmt = stmt.on_conflict_do_nothing(
+            index_elements=RECURRING_EXPENSE_KEY
+        ).returning(Expense)
+        created_expenses = db.session.scalars(stmt, expense_rows).all()
+        
+        # RETURNING only yields inserted rows, so restore the queued order explicitly
+        row_order = {
+            (row['recurring_payment_id'], row['date']): index
+            for index, row in enumerate(expense_rows)
+        }
+        created_expenses.sort(key=lambda expense: row_order[(expense.recurring_payment_id, expense.date)])
+        return created_expenses
+    
+    @staticmethod
+    def _has_recurring_expense_index():
+        """
+        Whether the expense table has the unique index ON CONFLICT needs
+        
+        It is missing until the migration adding it has run - startup processing
+        can get there first (create_app runs it when flask db upgrade loads the app),
+        and databases built with create_all on an existing schema never get it.
+        Only a positive answer is remembered, so a later migration is picked up.
+        """
+        bind = db.session.get_bind()
+        database_key = str(bind.url)
+        if database_key not in RecurringPaymentService._databases_with_recurring_expense_index:
+            indexes = inspect(db.session.connection()).get_indexes('expense')
+            if any(index['unique'] and index['column_names'] == RECURRING_EXPENSE_KEY for index in indexes):
+                RecurringPaymentService._databases_with_recurring_expense_index.add(database_key)
+            else:
+                return False
+        return True
+    
+    @staticmethod
+    def _insert_participant_rows(participant_rows):
+        """Bulk-insert ExpenseParticipant rows in chunks instead of one INSERT per participant"""
+        for start in range(0, len(participant_rows), PARTICIPANT_INSERT_CHUNK_SIZE):
+            db.session.execute(
+                ExpenseParticipant.__table__.insert(),
+                participant_rows[start:start + PARTICIPANT_INSERT_CHUNK_SIZE]
+            )
+    
+    @staticmethod
+    def _build_expense_row(recurring_payment, expense_date):
+        """
+        Build the column values for an expense generated from a recurring payment
         FIXED: Properly includes group_id and ensures all required fields
         """
         # Ensure description has "Recurring" in it
@@ -156,75 +281,90 @@ class RecurringPaymentService:
         elif not description.strip():
             description = "Recurring"
         
-        logger.info(f"         Creating expense with description: '{description}' for group {recurring_payment.group_id}")
+        logger.debug("         Creating expense with description: '%s' for group %s", description, recurring_payment.group_id)
         
         # FIXED: Ensure group_id is properly set
         if not recurring_payment.group_id:
             raise Exception(f"Recurring payment {recurring_payment.id} has no group_id - cannot create expense")
         
-        # Create the expense with proper group_id
-        expense = Expense(
-            amount=recurring_payment.amount,
-            category_id=recurring_payment.category_id,
-            category_description=description,
-            user_id=recurring_payment.user_id,
-            date=expense_date,
-            split_type='equal',
-            recurring_payment_id=recurring_payment.id,
-            group_id=recurring_payment.group_id  # CRITICAL: Include group_id
-        )
-        
-        db.session.add(expense)
-        db.session.flush()  # Get the expense ID
-        
-        logger.info(f"         Added expense to session with ID: {expense.id} for group: {recurring_payment.group_id}")
+        return {
+            'amount': recurring_payment.amount,
+            'category_id': recurring_payment.category_id,
+            'category_description': description,
+            'user_id': recurring_payment.user_id,
+            'date': expense_date,
+            'split_type': 'equal',
+            'recurring_payment_id': recurring_payment.id,
+            'group_id': recurring_payment.group_id  # CRITICAL: Include group_id
+        }
+    
+    @staticmethod
+    def _resolve_participants(recurring_payment, group_member_ids=None):
+        """
+        Work out who splits a recurring payment's expenses
         
+        Returns:
+            tuple: (valid_participant_ids, amount_per_person)
+        """
         # Only use explicitly defined participants
         participant_ids = recurring_payment.get_participant_ids()
         
         if not participant_ids:
             # If no participants specified, only include the payer
             participant_ids = [recurring_payment.user_id]
-            logger.info(f"         No specific participants, using only payer: {participant_ids}")
+            logger.debug("         No specific participants, using only payer: %s", participant_ids)
         else:
-            logger.info(f"         Using explicitly defined participants: {participant_ids}")
+            logger.debug("         Using explicitly defined participants: %s", participant_ids)
         
         # Validate that all participant users still exist and are in the group
-        from models import Group
-        group = Group.query.get(recurring_payment.group_id)
-        if not group:
-            raise Exception(f"Group {recurring_payment.group_id} not found")
+        if group_member_ids is None:
+            group = recurring_payment.group
+            if not group:
+                raise Exception(f"Group {recurring_payment.group_id} not found")
+            group_member_ids = frozenset(member.id for member in group.members)
         
-        valid_participants = []
-        group_member_ids = [member.id for member in group.members]
+        # Membership also proves the user exists - user_groups.user_id references user.id
+        valid_participants = [user_id for user_id in participant_ids if user_id in group_member_ids]
         
-        for user_id in participant_ids:
-            user = User.query.get(user_id)
-            if user and user.id in group_member_ids:
-                valid_participants.append(user_id)
-                logger.info(f"         ✅ Participant user {user_id} ({user.name}) is valid group member")
-            else:
-                logger.warning(f"         ⚠️  Participant user {user_id} no longer exists or not in group, skipping")
+        if logger.isEnabledFor(logging.DEBUG):
+            for user_id in valid_participants:
+                logger.debug("         ✅ Participant user %s is valid group member", user_id)
+        for user_id in set(participant_ids).difference(valid_participants):
+            logger.warning("         ⚠️  Participant user %s no longer exists or not in group, skipping", user_id)
         
         if not valid_participants:
             # Fallback to just the payer if no valid participants
             if recurring_payment.user_id in group_member_ids:
                 valid_participants = [recurring_payment.user_id]
-                logger.info(f"         Using only payer as fallback: {valid_participants}")
+                logger.debug("         Using only payer as fallback: %s", valid_participants)
             else:
                 raise Exception(f"Payer user {recurring_payment.user_id} is not in group {recurring_payment.group_id}")
         
         amount_per_person = recurring_payment.amount / len(valid_participants)
-        logger.info(f"         Amount per person: ${amount_per_person:.2f} (split among {len(valid_participants)} participants)")
+        logger.debug("         Amount per person: $%.2f (split among %d participants)", amount_per_person, len(valid_participants))
         
-        for user_id in valid_participants:
-            participant = ExpenseParticipant(
-                expense_id=expense.id,
-                user_id=user_id,
-                amount_owed=amount_per_person
-            )
-            db.session.add(participant)
-            logger.info(f"         Added participant: user {user_id}, owes ${amount_per_person:.2f}")
+        return valid_participants, amount_per_person
+    
+    @staticmethod
+    def _create_expense_for_date(recurring_payment, expense_date, group_member_ids=None):
+        """
+        Create an expense record from a recurring payment for a specific date
+        Used for one-off creation; batch processing inserts rows in bulk instead
+        """
+        valid_participants, amount_per_person = RecurringPaymentService._resolve_participants(
+            recurring_payment, group_member_ids
+        )
+        
+        expense = Expense(**RecurringPaymentService._build_expense_row(recurring_payment, expense_date))
+        db.session.add(expense)
+        db.session.flush()  # Get the expense ID
+        
+        logger.debug("         Added expense to session with ID: %s for group: %s", expense.id, recurring_payment.group_id)
+        
+        RecurringPaymentService._insert_participant_rows([
+            {'expense_id': expense.id, 'user_id': user_id, 'amount_owed': amount_per_person}
+            for user_id in valid_participants
+        ])
         
         return expense
     
@@ -241,13 +381,16 @@ class RecurringPaymentService:
         FIXED: Also updates balances after manual processing
         """
         expense = RecurringPaymentService._create_expense_for_date(recurring_payment, expense_date)
+        # Read before commit: touching expired attributes afterwards would open a
+        # transaction and make recalculate_all_balances fail to begin its own
+        group_id = recurring_payment.group_id
         
         # Update balances after manual processing
         try:
             db.session.commit()  # Commit the expense first
-            logger.info(f"💰 MANUAL: Updating balances for group {recurring_payment.group_id} after manual processing")
-            BalanceService.recalculate_all_balances()
-            logger.info(f"✅ MANUAL: Successfully updated balances for group {recurring_payment.group_id}")
+            logger.info(f"💰 MANUAL: Updating balances for group {group_id} after manual processing")
+            BalanceService.recalculate_all_balances(group_ids=[group_id])
+            logger.info(f"✅ MANUAL: Successfully updated balances for group {group_id}")
         except Exception as e:
             logger.error(f"❌ MANUAL: Error updating balances: {e}")
             # Don't fail the operation, but log the error
@@ -268,7 +411,6 @@ class RecurringPaymentService:
             raise ValueError("Group ID is required")
         
         # Validate group exists
-        from models import Group
         group = Group.query.get(group_id)
         if not group:
             raise ValueError(f"Group {group_id} not found")
@@ -306,11 +448,14 @@ class RecurringPaymentService:
         # If start date is in the past, use the unified processing logic
         if start_date < current_date:
             logger.info(f"[CREATE] Start date is in past, processing due payments through today")
-            # Temporarily commit the recurring payment so process_due_payments can find it
+            # Persist the recurring payment before generating its past expenses
             db.session.commit()
             
-            # Use the same unified logic to create all past expenses (includes balance updates)
-            created_expenses = RecurringPaymentService.process_group_due_payments(group_id, current_date)
+            # Use the same unified logic to create all past expenses (includes balance updates),
+            # handing over the new payment instead of re-querying the group's due payments
+            created_expenses = RecurringPaymentService.process_group_due_payments(
+                group_id, current_date, group=group, due_payments=[recurring_payment]
+            )
             logger.info(f"[CREATE] Created {len(created_expenses)} past expenses with balance updates")
         else:
             db.session.commit()
@@ -442,20 +587,58 @@ class RecurringPaymentService:
         if check_date is None:
             check_date = datetime.now().date()
         
-        from models import Group
-        all_groups = Group.query.all()
+        # Fetch due payments for every group in one query and bucket them by group
+        payments_by_group = defaultdict(list)
+        due_payments = RecurringPaymentService._due_payments_query(check_date).filter(
+            RecurringPayment.group_id.isnot(None)
+        ).all()
+        for payment in due_payments:
+            payments_by_group[payment.group_id].append(payment)
         
         all_created_expenses = []
         groups_with_updates = []
         
-        for group in all_groups:
-            logger.info(f"🏢 Processing recurring payments for group {group.id} ({group.name})")
-            group_expenses = RecurringPaymentService.process_group_due_payments(group.id, check_date)
+        for group_id in sorted(payments_by_group):
+            group_payments = payments_by_group[group_id]
+            group = group_payments[0].group
+            if group is None:
+                logger.warning("⚠️  Skipping %d due payments with missing group %s", len(group_payments), group_id)
+                continue
+            
+            logger.info("🏢 Processing recurring payments for group %s (%s)", group.id, group.name)
+            try:
+                # A SAVEPOINT per group: a failure rolls back only this group's work, while
+                # the other groups' loaded payments stay unexpired until the single commit below
+                with db.session.begin_nested():
+                    group_expenses = RecurringPaymentService.process_group_due_payments(
+                        group.id, check_date, defer_balance_update=True, group=group, due_payments=group_payments,
+                        defer_commit=True
+                    )
+            except Exception as e:
+                logger.error("❌ Error processing recurring payments for group %s, its payments stay due: %s", group_id, e)
+                continue
             all_created_expenses.extend(group_expenses)
             
             if group_expenses:
                 groups_with_updates.append(group.id)
         
+        # One commit for every group, after the loop has finished reading the loaded payments
+        if due_payments:
+            try:
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"❌ SYSTEM-WIDE: Error saving recurring payments, they stay due: {e}")
+                return []
+        
+        # Recalculate balances once for every touched group instead of once per group
+        if groups_with_updates:
+            try:
+                logger.info(f"💰 BALANCES: Updating balances for {len(groups_with_updates)} groups")
+                BalanceService.recalculate_all_balances(group_ids=groups_with_updates)
+            except Exception as e:
+                logger.error(f"❌ BALANCES: Error updating balances: {e}")
+        
         logger.info(f"✅ SYSTEM-WIDE: Processed {len(all_created_expenses)} expenses across {len(groups_with_updates)} groups")
         
         return all_created_expenses
\ No newline at end of file
@@ -5,11 +5,16 @@ Startup processor for recurring payments - FIXED with correct balance service ca
 """
 
 import logging
-from datetime import datetime, date, timedelta
-from models import db, RecurringPayment, Expense, Group
+from datetime import datetime, date
+from itertools import groupby
+from operator import attrgetter
+from sqlalchemy import update
+from sqlalchemy.orm import joinedload, load_only, raiseload
+from models import db, RecurringPayment, Group
 
 # FIXED: Import the correct service for balance calculation
 from app.services.tracker.expense_service import ExpenseService
+from app.services.tracker.recurring_service import RecurringPaymentService
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -29,257 +34,284 @@ class StartupRecurringProcessor:
                 logger.info("🚀 STARTUP: Checking for due/overdue recurring payments...")
                 
                 today = date.today()
+                # One timestamp for every payment touched in this startup run
+                run_ts = datetime.utcnow()
                 
-                # CRITICAL FIX: Process by group to maintain group context
-                all_groups = Group.query.all()
+                # A group is recalculated once however many of its payments created expenses
+                groups_with_updates = set()
+                # Everything to write for one group, committed group by group so a failure
+                # in one group doesn't discard the others' work:
+                #   pending_expenses - (expense_row, participant_ids, amount_per_person);
+                #     dates that already have an expense are skipped by the insert itself
+                #   rescheduled_payments / deactivated_payment_ids - written with bulk UPDATEs
+                group_batches = []
+                # next_due_date of each payment before this run, for logging after the commit
+                previous_due_dates = {}
+                group_names = {}
                 
-                if not all_groups:
-                    logger.info("ℹ️  STARTUP: No groups found")
-                    return
+                due_query_options = [
+                    joinedload(RecurringPayment.category_obj),
+                    # Group and its members are needed for every payment's participant check
+                    joinedload(RecurringPayment.group).selectinload(Group.members),
+                    # Only the columns the scheduling and expense building below read
+                    load_only(
+                        RecurringPayment.id,
+                        RecurringPayment.amount,
+                        RecurringPayment.category_id,
+                        RecurringPayment.category_description,
+                        RecurringPayment.user_id,
+                        RecurringPayment.group_id,
+                        RecurringPayment.frequency,
+                        RecurringPayment.interval_value,
+                        RecurringPayment.next_due_date,
+                        RecurringPayment.end_date,
+                        RecurringPayment.participant_ids
+                    )
+                ]
+                if app.debug:
+                    # Make any relationship the loop would lazy-load fail loudly during development
+                    due_query_options.append(raiseload('*'))
                 
-                logger.info(f"🏢 STARTUP: Found {len(all_groups)} groups to check")
+                # Payments already past their end date have no dates left to create -
+                # deactivate them all in one UPDATE instead of rescheduling each below
+                expired_count = RecurringPayment.query.filter(
+                    RecurringPayment.group_id.isnot(None),
+                    RecurringPayment.is_active == True,
+                    RecurringPayment.next_due_date <= today,
+                    RecurringPayment.end_date < RecurringPayment.next_due_date
+                ).update(
+                    {'is_active': False, 'next_due_date': datetime(9999, 1, 1), 'last_updated': run_ts},
+                    synchronize_session=False
+                )
+                if expired_count:
+                    db.session.commit()
+                    logger.info("🔚 STARTUP: Deactivated %s payments past their end date", expired_count)
                 
-                total_processed = 0
-                total_skipped = 0
-                groups_with_updates = []
+                # Get due payments for every group in one query, ordered so they can be
+                # processed group by group to maintain group context
+                due_payments = RecurringPayment.query.options(*due_query_options).filter(
+                    RecurringPayment.group_id.isnot(None),
+                    RecurringPayment.is_active == True,
+                    RecurringPayment.next_due_date <= today
+                ).order_by(RecurringPayment.group_id, RecurringPayment.id).all()
                 
-                for group in all_groups:
-                    logger.info(f"📋 STARTUP: Checking group {group.id} ({group.name})")
-                    
-                    # Get due payments for this specific group
-                    due_and_overdue = RecurringPayment.query.filter(
-                        RecurringPayment.group_id == group.id,
-                        RecurringPayment.is_active == True,
-                        RecurringPayment.next_due_date <= today
-                    ).all()
-                    
-                    if not due_and_overdue:
-                        logger.info(f"   ✅ No due payments for group {group.id}")
-                        continue
-                    
-                    logger.info(f"   📋 Found {len(due_and_overdue)} payments to check:")
-                    
-                    group_processed = 0
-                    group_skipped = 0
-                    
-                    for payment in due_and_overdue:
-                        # CRITICAL: Verify payment belongs to this group
-                        if payment.group_id != group.id:
-                            logger.error(f"   ❌ CRITICAL: Payment {payment.id} has group_id {payment.group_id} but processing group {group.id}")
+                if not due_payments:
+                    logger.info("ℹ️  STARTUP: No due recurring payments found")
+                    return
+                
+                logger.info("🏢 STARTUP: Found %s due payments to check", len(due_payments))
+                
+                # Work out every group's rows up front - committing expires the loaded
+                # payments, so nothing below may read them once the first group is saved
+                with db.session.no_autoflush:
+                    for group_id, group_payments in groupby(due_payments, key=attrgetter('group_id')):
+                        group_payments = list(group_payments)
+                        group = group_payments[0].group
+                        if group is None:
+                            logger.error("   ❌ CRITICAL: Group %s not found for %s due payments", group_id, len(group_payments))
                             continue
                         
-                        days_diff = (today - payment.next_due_date).days
-                        status = "due today" if days_diff == 0 else f"overdue by {days_diff} days"
+                        logger.info("📋 STARTUP: Checking group %s (%s)", group.id, group.name)
+                        logger.info("   📋 Found %s payments to check:", len(group_payments))
+                        group_names[group.id] = group.name
                         
-                        logger.info(f"   🔍 Checking: {payment.category_obj.name} - ${payment.amount} ({status})")
+                        # Membership is the same for every payment in the group
+                        group_member_ids = frozenset(member.id for member in group.members)
                         
-                        # Process ALL missed dates from next_due_date up through today
-                        current_due_date = payment.next_due_date
-                        payment_expenses = []
+                        pending_expenses = []
+                        rescheduled_payments = []
+                        deactivated_payment_ids = []
+                    
+                        for payment in group_payments:
+                            if logger.isEnabledFor(logging.INFO):
+                                days_diff = (today - payment.next_due_date).days
+                                status = "due today" if days_diff == 0 else f"overdue by {days_diff} days"
+                                logger.info("   🔍 Checking: %s - $%s (%s)", payment.category_obj.name, payment.amount, status)
                         
-                        while current_due_date <= today:
-                            # Check if current_due_date is beyond end_date BEFORE processing
-                            if payment.end_date and current_due_date > payment.end_date:
-                                logger.info(f"      🔚 Current due date {current_due_date} is beyond end date {payment.end_date}, stopping processing")
-                                break
-                            
-                            # CRITICAL: Check for existing expense with GROUP_ID filter
-                            existing_expense = Expense.query.filter(
-                                Expense.recurring_payment_id == payment.id,
-                                Expense.date == current_due_date,
-                                Expense.group_id == group.id  # CRITICAL: Add group_id filter
-                            ).first()
+                            # Process ALL missed dates from next_due_date up through today,
+                            # never going past the payment's end_date
+                            due_dates, next_after_window = StartupRecurringProcessor._schedule_dates(payment, today)
                             
-                            if existing_expense:
-                                logger.info(f"      ⏭️  Skipped: Expense #{existing_expense.id} already exists for {current_due_date}")
-                                group_skipped += 1
-                            else:
-                                # Create expense for this date with GROUP CONTEXT
-                                logger.info(f"      ✨ Creating expense for {current_due_date}...")
-                                
+                            if due_dates:
+                                # Description and participant split are the same for every missed date,
+                                # worked out by the same helpers the regular processor uses
                                 try:
-                                    expense = StartupRecurringProcessor._create_expense_from_recurring_startup(
-                                        payment, 
-                                        current_due_date,
-                                        group  # CRITICAL: Pass group context
+                                    valid_participants, amount_per_person = RecurringPaymentService._resolve_participants(
+                                        payment, group_member_ids
                                     )
-                                    
-                                    payment_expenses.append(expense)
-                                    
-                                    logger.info(f"      ✅ Created expense #{expense.id} for ${expense.amount}")
-                                    group_processed += 1
-                                    
+                                    expense_row = RecurringPaymentService._build_expense_row(payment, due_dates[0])
                                 except Exception as e:
-                                    logger.error(f"      ❌ Error creating expense for {current_due_date}: {e}")
+                                    # Leave next_due_date alone so the next run retries this payment
+                                    logger.error("      ❌ Error creating expenses for payment %s, leaving it due: %s", payment.id, e)
                                     continue
+                                else:
+                                    for current_due_date in due_dates:
+                                        # Queue expense for this date with GROUP CONTEXT
+                                        logger.debug("      ✨ Creating expense for %s...", current_due_date)
+                                        pending_expenses.append(
+                                            ({**expense_row, 'date': current_due_date}, valid_participants, amount_per_person)
+                                        )
                             
-                            # Calculate next occurrence
-                            old_due_date = current_due_date
-                            current_due_date = payment.calculate_next_due_date(old_due_date)
+                            # Update recurring payment next_due_date - every date in the window will
+                            # have an expense, created here or already existing
+                            next_would_be_due = next_after_window
                             
-                            # Safety check to prevent infinite loops
-                            if current_due_date <= old_due_date:
-                                logger.error(f"      ⚠️  Date calculation error: {old_due_date} -> {current_due_date}")
-                                break
-                        
-                        # Update recurring payment next_due_date
-                        if payment_expenses:  # If we processed any expenses
-                            last_processed_date = payment_expenses[-1].date
-                            next_would_be_due = payment.calculate_next_due_date(last_processed_date)
-                        else:
-                            next_would_be_due = payment.calculate_next_due_date(payment.next_due_date)
+                            # Check if the next due date would be beyond the end date
+                            if payment.end_date and next_would_be_due > payment.end_date:
+                                # Payment has ended - deactivate it and set sentinel date
+                                sentinel_date = datetime(9999, 1, 1)
+                                deactivated_payment_ids.append(payment.id)
+                                logger.info("      🔚 Payment %s: next due date %s would be beyond end date %s", payment.id, next_would_be_due, payment.end_date)
+                                logger.info("      🔚 Set payment as inactive with sentinel date: %s", sentinel_date)
+                            else:
+                                # Update the recurring payment's next_due_date to the next future date
+                                rescheduled_payments.append({
+                                    'id': payment.id,
+                                    'next_due_date': next_would_be_due,
+                                    'last_updated': run_ts
+                                })
+                                previous_due_dates[payment.id] = payment.next_due_date
                         
-                        # Check if the next due date would be beyond the end date
-                        if payment.end_date and next_would_be_due > payment.end_date:
-                            # Payment has ended - deactivate it and set sentinel date
-                            sentinel_date = datetime(9999, 1, 1)
-                            payment.is_active = False
-                            payment.next_due_date = sentinel_date
-                            payment.last_updated = datetime.utcnow()
-                            logger.info(f"      🔚 Next due date {next_would_be_due} would be beyond end date {payment.end_date}")
-                            logger.info(f"      🔚 Set payment as inactive with sentinel date: {sentinel_date}")
-                        else:
-                            # Update the recurring payment's next_due_date to the next future date
-                            old_next_due = payment.next_due_date
-                            payment.next_due_date = next_would_be_due
-                            payment.last_updated = datetime.utcnow()
-                            
-                            if payment_expenses:
-                                logger.info(f"      📅 Updated next due date: {old_next_due} → {payment.next_due_date}")
+                        group_batches.append({
+                            'group_id': group.id,
+                            'pending_expenses': pending_expenses,
+                            'rescheduled_payments': rescheduled_payments,
+                            'deactivated_payment_ids': deactivated_payment_ids
+                        })
+                
+                total_processed = 0
+                total_skipped = 0
+                changes_committed = False
+                
+                for batch in group_batches:
+                    group_id = batch['group_id']
+                    pending_expenses = batch['pending_expenses']
+                    rescheduled_payments = batch['rescheduled_payments']
+                    deactivated_payment_ids = batch['deactivated_payment_ids']
+                    if not (pending_expenses or rescheduled_payments or deactivated_payment_ids):
+                        continue
                     
-                    # Track groups that had updates
-                    if group_processed > 0:
-                        groups_with_updates.append(group.id)
+                    try:
+                        created_expenses = []
+                        if pending_expenses:
+                            created_expenses = StartupRecurringProcessor._insert_pending_expenses(pending_expenses)
+                        
+                        # Read what was created before the commit expires it
+                        last_processed_dates = {}
+                        processed_by_payment = {}
+                        for expense in created_expenses:
+                            last_processed_dates[expense.recurring_payment_id] = expense.date
+                            processed_by_payment[expense.recurring_payment_id] = processed_by_payment.get(expense.recurring_payment_id, 0) + 1
+                        
+                        if rescheduled_payments:
+                            # ORM bulk UPDATE by primary key - one executemany for every payment
+                            db.session.execute(update(RecurringPayment), rescheduled_payments)
+                        if deactivated_payment_ids:
+                            db.session.execute(
+                                update(RecurringPayment)
+                                .where(RecurringPayment.id.in_(deactivated_payment_ids))
+                                .values(is_active=False, next_due_date=datetime(9999, 1, 1), last_updated=run_ts)
+                                .execution_options(synchronize_session=False)
+                            )
+                        db.session.commit()
+                    except Exception as e:
+                        db.session.rollback()
+                        logger.error("   ❌ Error saving group %s, its payments stay due: %s", group_id, e)
+                        continue
                     
+                    changes_committed = True
+                    group_processed = len(created_expenses)
+                    group_skipped = len(pending_expenses) - group_processed
                     total_processed += group_processed
                     total_skipped += group_skipped
                     
-                    if group_processed > 0 or group_skipped > 0:
-                        logger.info(f"   📊 Group {group.id}: processed {group_processed}, skipped {group_skipped}")
+                    # One summary line per payment instead of a line per date
+                    queued_by_payment = {}
+                    for expense_row, _, _ in pending_expenses:
+                        queued_by_payment[expense_row['recurring_payment_id']] = queued_by_payment.get(expense_row['recurring_payment_id'], 0) + 1
+                    for payment_id, payment_queued in queued_by_payment.items():
+                        payment_processed = processed_by_payment.get(payment_id, 0)
+                        logger.info("      🧾 Payment %s: created %s, skipped %s", payment_id, payment_processed, payment_queued - payment_processed)
+                    
+                    if pending_expenses:
+                        # Track groups that had updates
+                        if group_processed > 0:
+                            groups_with_updates.add(group_id)
+                        logger.info("   📊 Group %s: processed %s, skipped %s", group_id, group_processed, group_skipped)
+                    
+                    for rescheduled in rescheduled_payments:
+                        if rescheduled['id'] in last_processed_dates:
+                            logger.info("      📅 Payment %s: updated next due date: %s → %s", rescheduled['id'], previous_due_dates[rescheduled['id']], rescheduled['next_due_date'])
                 
-                # Commit all changes
-                if total_processed > 0 or total_skipped > 0:
-                    db.session.commit()
-                    logger.info(f"✅ STARTUP: Processed {total_processed} payments, skipped {total_skipped} (already existed)")
+                if changes_committed:
+                    logger.info("✅ STARTUP: Processed %s payments, skipped %s (already existed)", total_processed, total_skipped)
                     
                     # FIXED: Use the correct method to update balances
                     if groups_with_updates:
-                        logger.info(f"💰 STARTUP: Updating balances for {len(groups_with_updates)} groups...")
+                        logger.info("💰 STARTUP: Updating balances for %s groups...", len(groups_with_updates))
                         
-                        for group_id in groups_with_updates:
+                        # Recalculated one after another on this session - it is not safe to share across threads
+                        for group_id in sorted(groups_with_updates):
                             try:
                                 # FIXED: Use ExpenseService._recalculate_group_balances instead
                                 ExpenseService._recalculate_group_balances(group_id)
-                                group = Group.query.get(group_id)
-                                group_name = group.name if group else f"Group {group_id}"
-                                logger.info(f"   ✅ Updated balances for {group_name}")
+                                logger.info("   ✅ Updated balances for %s", group_names[group_id])
                             except Exception as e:
-                                logger.error(f"   ❌ Error updating balances for group {group_id}: {e}")
+                                logger.error("   ❌ Error updating balances for group %s: %s", group_id, e)
                         
                         logger.info("🎉 STARTUP: Balance updates completed")
                 else:
                     logger.info("ℹ️  STARTUP: No changes made")
                 
             except Exception as e:
-                logger.error(f"❌ STARTUP ERROR: {e}")
+                logger.error("❌ STARTUP ERROR: %s", e)
                 logger.exception("Full traceback:")
                 db.session.rollback()
     
     @staticmethod
-    def _create_expense_from_recurring_startup(recurring_payment, expense_date, group):
+    def _schedule_dates(payment, today):
         """
-        Create an expense record from a recurring payment for startup processing
-        CRITICAL FIX: Now includes group_id and validates group membership
-        """
-        from models import ExpenseParticipant, User
-        
-        # CRITICAL: Validate group_id exists
-        if not recurring_payment.group_id:
-            error_msg = f"CRITICAL: Recurring payment {recurring_payment.id} has no group_id"
-            logger.error(error_msg)
-            raise Exception(error_msg)
-        
-        if recurring_payment.group_id != group.id:
-            error_msg = f"CRITICAL: Group mismatch - payment has group_id {recurring_payment.group_id}, processing group {group.id}"
-            logger.error(error_msg)
-            raise Exception(error_msg)
+        Every due date of a payment from its next_due_date through today, capped at its end_date
         
-        # Ensure description has "Recurring" in it
-        description = recurring_payment.category_description or ""
-        if description.strip() and "recurring" not in description.lower():
-            description = f"{description} - Recurring"
-        elif not description.strip():
-            description = "Recurring"
-        
-        logger.info(f"         Creating expense with description: '{description}' for group {group.id}")
+        Returns:
+            tuple: (due_dates, next_after_window) - the first due date after the last one returned
+        """
+        window_end = today
+        if payment.end_date and payment.end_date < window_end:
+            window_end = payment.end_date
+            logger.info("      🔚 Not processing past end date %s", payment.end_date)
+        due_dates = payment.generate_due_dates(payment.next_due_date, window_end)
+        next_after_window = payment.calculate_next_due_date(due_dates[-1] if due_dates else payment.next_due_date)
+        return due_dates, next_after_window
+    
+    @staticmethod
+    def _insert_pending_expenses(pending_expenses):
+        """
+        RETURNING, then all of their participants in chunked executemany batches
+        RETURNING, then all of their participants with one executemany
         
-        # CRITICAL FIX: Create the expense WITH group_id
-        expense = Expense(
-            amount=recurring_payment.amount,
-            category_id=recurring_payment.category_id,
-            category_description=description,
-            user_id=recurring_payment.user_id,
-            date=expense_date,
-            split_type='equal',
-            recurring_payment_id=recurring_payment.id,
-            group_id=recurring_payment.group_id  # CRITICAL: This was missing!
+        Returns:
+            list: the Expense objects actually inserted; dates that already had
+            an expense for their recurring payment are skipped
+        """
+        expenses = RecurringPaymentService._insert_expense_rows(
+            [expense_row for expense_row, _, _ in pending_expenses]
         )
         
-        # Validate the group_id was set correctly
-        if expense.group_id != recurring_payment.group_id:
-            error_msg = f"CRITICAL: Expense group_id {expense.group_id} doesn't match recurring payment group_id {recurring_payment.group_id}"
-            logger.error(error_msg)
-            raise Exception(error_msg)
-        
-        db.session.add(expense)
-        db.session.flush()  # Get the expense ID
-        
-        logger.info(f"         Added expense to session with ID: {expense.id} for group: {expense.group_id}")
-        
-        # Get participants and validate they're group members
-        participant_ids = recurring_payment.get_participant_ids()
-        
-        if not participant_ids:
-            participant_ids = [recurring_payment.user_id]
-            logger.info(f"         No specific participants, using only payer: {participant_ids}")
-        else:
-            logger.info(f"         Using explicitly defined participants: {participant_ids}")
-        
-        # CRITICAL: Validate participants are still group members
-        group_member_ids = [member.id for member in group.members]
-        valid_participants = []
-        
-        for user_id in participant_ids:
-            user = User.query.get(user_id)
-            if user and user_id in group_member_ids:
-                valid_participants.append(user_id)
-                logger.info(f"         ✅ Participant {user.name} (ID: {user_id}) is valid group member")
-            else:
-                logger.warning(f"         ⚠️  Participant user {user_id} no longer exists or not in group, skipping")
-        
-        if not valid_participants:
-            # Fallback to just the payer if they're in the group
-            if recurring_payment.user_id in group_member_ids:
-                valid_participants = [recurring_payment.user_id]
-                logger.info(f"         Using only payer as fallback: {valid_participants}")
-            else:
-                error_msg = f"CRITICAL: No valid participants including payer {recurring_payment.user_id} for group {group.id}"
-                logger.error(error_msg)
-                raise Exception(error_msg)
-        
-        amount_per_person = recurring_payment.amount / len(valid_participants)
-        logger.info(f"         Amount per person: ${amount_per_person:.2f} ({len(valid_participants)} participants)")
-        
-        for user_id in valid_participants:
-            participant = ExpenseParticipant(
-                expense_id=expense.id,
-                user_id=user_id,
-                amount_owed=amount_per_person
+        splits = {
+            (expense_row['recurring_payment_id'], expense_row['date']): (valid_participants, amount_per_person)
+            for expense_row, valid_participants, amount_per_person in pending_expenses
+        }
+        participant_rows = []
+        for expense in expenses:
+            valid_participants, amount_per_person = splits[(expense.recurring_payment_id, expense.date)]
+            participant_rows.extend(
+                {'expense_id': expense.id, 'user_id': user_id, 'amount_owed': amount_per_person}
+                for user_id in valid_participants
             )
-            db.session.add(participant)
-            logger.info(f"         Added participant: user {user_id}, owes ${amount_per_person:.2f}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("      ✅ CREATED: Expense %s, amount=$%s, date=%s, group=%s, participants=%s", expense.id, expense.amount, expense.date, expense.group_id, len(valid_participants))
         
-        # Final validation
-        logger.info(f"         ✅ CREATED: Expense {expense.id}, amount=${expense.amount}, group={expense.group_id}, participants={len(valid_participants)}")
+        RecurringPaymentService._insert_participant_rows(participant_rows)
         
-        return expense
\ No newline at end of file
+        return expenses
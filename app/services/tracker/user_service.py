@@ -1,6 +1,8 @@
-from models import db, User, Expense, Balance, ExpenseParticipant, Group
-from flask import url_for
-from sqlalchemy import func
+from models import db, User, Expense, Balance, ExpenseParticipant, Group, user_groups
+from flask import url_for, abort
+from sqlalchemy import func, and_
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime
 
 class UserService:
     
@@ -12,8 +14,29 @@ class UserService:
     @staticmethod
     def get_all_data():
         """Get all users as list of dicts for JSON/template use"""
-        users = User.query.all()
-        return [{'id': u.id, 'name': u.name} for u in users]
+        # Project only the columns behind User.name instead of loading full User objects
+        rows = db.session.query(User.id, User.display_name, User.full_name).all()
+        return [{'id': r.id, 'name': r.display_name or r.full_name} for r in rows]
+    
+    @staticmethod
+    def _is_member(group_id, user_id):
+        """EXISTS probe for group membership instead of loading the whole members collection"""
+        return db.session.query(
+            db.session.query(user_groups).filter(
+                user_groups.c.group_id == group_id,
+                user_groups.c.user_id == user_id
+            ).exists()
+        ).scalar()
+    
+    @staticmethod
+    def _insert_membership(user_id, group_id, role='member'):
+        """Insert the user_groups row directly; Group.add_member would load every member to check first"""
+        db.session.execute(user_groups.insert().values(
+            user_id=user_id,
+            group_id=group_id,
+            role=role,
+            joined_at=datetime.utcnow()
+        ))
     
     @staticmethod
     def create_user(name, group_id=None):
@@ -31,11 +54,11 @@ class UserService:
         existing_user = User.query.filter_by(name=name).first()
         if existing_user:
             if group_id:
-                group = Group.query.get(group_id)
-                if group and existing_user not in group.members:
+                group = db.session.get(Group, group_id)
+                if group and not UserService._is_member(group_id, existing_user.id):
                     # User exists but not in group - add them
                     try:
-                        group.add_member(existing_user)
+                        UserService._insert_membership(existing_user.id, group_id)
                         db.session.commit()
                         return existing_user, None
                     except Exception as e:
@@ -52,10 +75,11 @@ class UserService:
             db.session.flush()  # Get the user ID
             
             # Add to group if specified
+            # A brand-new user can't be a member yet, so no membership check is needed
             if group_id:
-                group = Group.query.get(group_id)
+                group = db.session.get(Group, group_id)
                 if group:
-                    group.add_member(new_user)
+                    UserService._insert_membership(new_user.id, group_id)
             
             db.session.commit()
             return new_user, None
@@ -64,7 +88,7 @@ class UserService:
             return None, str(e)
     
     @staticmethod
-    def can_delete_user(user_id, group_id=None):
+    def can_delete_user(user_id, group_id=None, user=None):
         """
         Check if user can be safely deleted or removed from group
         Only checks for non-zero balances - historical activity doesn't prevent removal if balance is settled
@@ -72,37 +96,33 @@ class UserService:
         Args:
             user_id: ID of user to check
             group_id: If provided, check constraints within this group only
+            user: Already-loaded User for user_id, to skip looking it up again
         
         Returns:
             tuple: (can_delete_boolean, list_of_reason_strings)
         """
-        user = User.query.get_or_404(user_id)
+        if user is None:
+            user = db.session.get(User, user_id) or abort(404)
         reasons = []
         
         if group_id:
             # Group-specific checks
-            group = Group.query.get(group_id)
-            if not group:
+            # Group creator and the user's balance there come back in one query, with any
+            # duplicate balance rows summed so the result doesn't depend on row order
+            row = db.session.query(Group.creator_id, func.sum(Balance.amount)).outerjoin(
+                Balance, and_(Balance.group_id == Group.id, Balance.user_id == user_id)
+            ).filter(Group.id == group_id).group_by(Group.id, Group.creator_id).first()
+            if not row:
                 return False, ["Group not found"]
             
-            if user.id == group.creator_id:  # Fixed: use user.id and creator_id
+            creator_id, balance_amount = row
+            if user.id == creator_id:  # Fixed: use user.id and creator_id
                 return False, ["Cannot remove the group creator"]
             
             # ONLY check if user has non-zero balance in this group
             # Historical expenses/settlements don't matter if balance is settled
-            balance = Balance.query.filter_by(user_id=user_id, group_id=group_id).first()
-            if balance and abs(balance.amount) > 0.01:
-                balance_url = url_for('expenses.group_tracker', group_id=group_id)
-                if balance.amount > 0:
-                    reasons.append(
-                        f"{user.name} is owed <strong>${balance.amount:.2f}</strong> "
-                        f"(<a href='{balance_url}'>settle balance first</a>)"
-                    )
-                else:
-                    reasons.append(
-                        f"{user.name} owes <strong>${abs(balance.amount):.2f}</strong> "
-                        f"(<a href='{balance_url}'>settle balance first</a>)"
-                    )
+            if balance_amount is not None:
+                reasons.extend(UserService._group_balance_reasons(user, balance_amount, group_id))
             
             # If balance is zero or doesn't exist, user can be removed regardless of historical activity
             # No other checks needed for group-specific removal
@@ -110,18 +130,22 @@ class UserService:
         else:
             # Global checks (legacy method for full user deletion)
             # For global deletion, we still check expenses since it affects other users
-            payer_expenses = user.expenses
-            if payer_expenses:
-                expense_url = url_for('dashboard.home')
+            expense_count = db.session.query(func.count(Expense.id)).filter(
+                Expense.user_id == user_id
+            ).scalar()
+            # Both reasons link to the dashboard; build that URL once
+            dashboard_url = None
+            if expense_count > 0:
+                dashboard_url = url_for('dashboard.home')
                 reasons.append(
                     f"{user.name} paid for "
-                    f"<a href='{expense_url}'>{len(payer_expenses)} expense(s)</a>"
+                    f"<a href='{dashboard_url}'>{expense_count} expense(s)</a>"
                 )
             
             # Check if user has non-zero balance globally
             net_balance = user.get_net_balance()
             if abs(net_balance) > 0.01:
-                balance_url = url_for('dashboard.home')
+                balance_url = dashboard_url or url_for('dashboard.home')
                 if net_balance > 0:
                     reasons.append(
                         f"{user.name} is owed <strong>${net_balance:.2f}</strong> "
@@ -136,6 +160,23 @@ class UserService:
         can_delete = len(reasons) == 0
         return can_delete, reasons
     
+    @staticmethod
+    def _group_balance_reasons(user, balance_amount, group_id):
+        """Reasons blocking removal from a group for a user's balance there"""
+        if abs(balance_amount) <= 0.01:
+            return []
+        
+        balance_url = url_for('expenses.group_tracker', group_id=group_id)
+        if balance_amount > 0:
+            return [
+                f"{user.name} is owed <strong>${balance_amount:.2f}</strong> "
+                f"(<a href='{balance_url}'>settle balance first</a>)"
+            ]
+        return [
+            f"{user.name} owes <strong>${abs(balance_amount):.2f}</strong> "
+            f"(<a href='{balance_url}'>settle balance first</a>)"
+        ]
+    
     @staticmethod
     def delete_user(user_id, group_id=None):
         """
@@ -149,12 +190,12 @@ class UserService:
             tuple: (success_boolean, error_message)
         """
         try:
-            can_delete, reasons = UserService.can_delete_user(user_id, group_id)
+            user = db.session.get(User, user_id) or abort(404)
+            
+            can_delete, reasons = UserService.can_delete_user(user_id, group_id, user=user)
             if not can_delete:
                 return False, "<br>".join(reasons)
             
-            user = User.query.get_or_404(user_id)
-            
             if group_id:
                 # Remove from group
                 group = Group.query.get_or_404(group_id)
@@ -180,15 +221,19 @@ class UserService:
             tuple: (success_boolean, error_message)
         """
         try:
-            user = User.query.get_or_404(user_id)
-            group = Group.query.get_or_404(group_id)
+            user = db.session.get(User, user_id) or abort(404)
+            group = db.session.get(Group, group_id) or abort(404)
             
-            if user in group.members:
-                return False, f"{user.name} is already a member of {group.name}"
+            user_name, group_name = user.name, group.name
             
-            group.add_member(user, role)
+            # The (user_id, group_id) primary key on user_groups rejects duplicates,
+            # so insert directly instead of checking membership first
+            UserService._insert_membership(user.id, group.id, role=role)
             db.session.commit()
             return True, None
+        except IntegrityError:
+            db.session.rollback()
+            return False, f"{user_name} is already a member of {group_name}"
         except Exception as e:
             db.session.rollback()
             return False, str(e)
\ No newline at end of file
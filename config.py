@@ -94,6 +94,9 @@ class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
     DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
     
+    # Compiled Jinja templates (None uses a per-user directory under the system temp dir)
+    JINJA_BYTECODE_CACHE_DIR = os.getenv('JINJA_BYTECODE_CACHE_DIR')
+    
     # Force DEBUG off in production
     if not IS_DEVELOPMENT:
         DEBUG = False
@@ -278,6 +278,12 @@ class Expense(db.Model):
     # relationship to participants
     participants = db.relationship("ExpenseParticipant", back_populates="expense", cascade="all, delete-orphan")
     
+    # One expense per recurring payment per date. Its (recurring_payment_id, date)
+    # prefix also serves the recurring/startup existence probes, so no separate index
+    __table_args__ = (
+        db.Index('ix_expense_rp_date_group', 'recurring_payment_id', 'date', 'group_id', unique=True),
+    )
+    
     def is_personal(self):
         """Check if this is a personal expense"""
         return self.group_id is None
@@ -414,7 +420,29 @@ class RecurringPayment(db.Model):
         else:
             # Default to monthly if unknown frequency
             return from_date + relativedelta(months=self.interval_value)
-    
+
+    def generate_due_dates(self, start, until):
+        """
+        Get every due date from start through until (inclusive)
+
+        Each date is one calculate_next_due_date step from the previous one, the same
+        rule used when next_due_date advances, so catching up several periods in one
+        run gives the same schedule as processing them one run at a time
+        """
+        if until < start:
+            return []
+
+        if self.interval_value <= 0:
+            # Non-advancing schedule - only the start date can be due
+            return [start]
+
+        due_dates = []
+        current_date = start
+        while current_date <= until:
+            due_dates.append(current_date)
+            current_date = self.calculate_next_due_date(current_date)
+        return due_dates
+
     def is_due(self, check_date=None):
         if not self.is_active:
             return False
@@ -0,0 +1,48 @@
+from models import db, User, Group, Category, Balance, Settlement
+from app.services.tracker.balance_service import BalanceService
+
+
+def _balances():
+    balances = {
+        (balance.user_id, balance.group_id): round(balance.amount, 2)
+        for balance in Balance.query.all()
+    }
+    # recalculate_all_balances opens its own transaction, so don't leave one open
+    db.session.commit()
+    return balances
+
+
+def _seed():
+    users = [User(full_name=f'User {i}', display_name=f'User {i}', email=f'user{i}@example.com') for i in range(3)]
+    db.session.add_all(users)
+    db.session.flush()
+    group = Group(name='Flat', invite_code='FLAT0001', creator_id=users[0].id)
+    db.session.add(group)
+    db.session.flush()
+    for user in users:
+        group.add_member(user)
+    category = Category(name='Groceries', group_id=group.id)
+    db.session.add(category)
+    db.session.commit()
+    return [user.id for user in users], group.id, category.id
+
+
+def test_expense_deltas_match_full_recalculation(app):
+    user_ids, group_id, category_id = _seed()
+    
+    # Existing history, including a settlement, with balances built from it
+    BalanceService.create_expense_with_participants(90.0, user_ids[0], user_ids, category_id)
+    db.session.add(Settlement(amount=20.0, payer_id=user_ids[1], receiver_id=user_ids[0]))
+    db.session.commit()
+    assert BalanceService.recalculate_all_balances()
+    
+    # New expenses are applied as deltas, including for users without a balance record yet
+    BalanceService.create_expense_with_participants(30.0, user_ids[1], [user_ids[1], user_ids[2]], category_id)
+    BalanceService.create_expense_with_participants(12.0, user_ids[2], [user_ids[0]], category_id)
+    BalanceService.create_expense_with_participants(
+        9.0, user_ids[0], user_ids, category_id, group_id=group_id
+    )
+    incremental = _balances()
+    
+    assert BalanceService.recalculate_all_balances()
+    assert incremental == _balances()